@@ -1,21 +1,42 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from datetime import datetime
-from typing import List, Literal, Tuple, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import datetime, timezone
+from typing import Any, Deque, Final, Iterable, List, Literal, Tuple, Dict, Optional
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 import re 
+import sys
 
-# --- 1. Pydantic Models (Data Structures) ---
+# --- 1. Models (Data Structures) ---
 
 RiskLevel = Literal["NONE", "LOW", "MEDIUM", "HIGH"]
 ActionType = Literal["PASSTHROUGH", "REWRITE"]
 
+# Shared literal values, used everywhere instead of re-spelling the strings
+NONE: Final = "NONE"
+LOW: Final = "LOW"
+MEDIUM: Final = "MEDIUM"
+HIGH: Final = "HIGH"
+PASSTHROUGH: Final = "PASSTHROUGH"
+REWRITE: Final = "REWRITE"
+
 class QueryRequest(BaseModel):
     """Input structure for the firewall check."""
     query: str
 
-class LogEntry(BaseModel):
-    """Data structure for a single log entry."""
+@dataclass(slots=True)
+class LogEntry:
+    """
+    Data structure for a single log entry.
+    Serves as the response schema; the entries themselves are stored as plain
+    dicts with these keys, so no model object is built per request.
+    """
     original_query: str
     safe_query: str
     risk_level: RiskLevel
@@ -23,13 +44,15 @@ class LogEntry(BaseModel):
     timestamp: datetime
     reason: str 
 
-class QueryResponse(LogEntry):
-    """Output structure for the firewall check (inherits from LogEntry)."""
-    pass
+# Output structure for the firewall check (same shape as LogEntry, so the
+# logged entry can be returned as-is)
+QueryResponse = LogEntry
 
 # --- 2. In-Memory Log Store and ML Simulation ---
 
-LOGS: List[LogEntry] = []
+# Ring buffer: keeps the most recent entries and drops the oldest, so memory stays bounded
+MAX_LOG_ENTRIES = 10_000
+LOGS: Deque[Dict[str, Any]] = deque(maxlen=MAX_LOG_ENTRIES)
 
 # SIMULATION: Retaining the ML architecture placeholder to show the roadmap
 REWRITE_MODEL_OUTPUT: Dict[str, str] = {
@@ -52,65 +75,183 @@ def load_ml_model():
 
 # --- 3. Core Firewall Logic (Expanded Heuristics) ---
 
-def detect_risk(query: str) -> Tuple[RiskLevel, str]:
+# --- Keyword Buckets ---
+# Keywords are matched against the lowercased query, so they must be lowercase too.
+
+# CRITICAL: Suicide/Self-Harm Detection
+SELF_HARM_KEYWORDS = (
+    'overdose', 'kill myself', 'self harm', 'suicide', 'hurt myself', 'want to die', 'poisoning', 
+    'end my life', 'lethal', 'fatal', 'commit suicide', 'i hate living', 'ending it', 'die now'
+)
+
+# HIGH Risk: Medication Adjustment/Abuse/Acute Symptoms
+HIGH_RISK_KEYWORDS = (
+    'inject', 'how much', 'combine meds', 'change my dose', 'take this', 
+    'skip dose', 'stop taking', 'adjust dose', 'bypass', 'prescription drug', # Dosing/Regimen changes
+    'chest pain', 'stroke', 'heart attack', 'emergency', 'faint', 'unresponsive', # Acute symptoms
+    'heroin', 'fentanyl', 'cocaine', 'meth', 'opioid', 'abuse', 'legal limit', # Illicit drugs/Abuse
+    'liver failure', 'respiratory distress', 'injection' # Serious medical intervention
+)
+
+# MEDIUM Risk: Diagnosis, Specific Treatment, Regimen Changes
+MEDIUM_RISK_KEYWORDS = (
+    'diagnose', 'is this', 'what tablet', 'cure for', 'prescription for', 'should i stop', 
+    'my symptoms mean', 'symptom of', 'serious', 'chronic fatigue', 'anxiety attack', 
+    'depression diagnosis', 'what is this lump', 'is it cancer', 'tumor', 'vaccine side effect'
+)
+
+# LOW Risk: General Health, Non-acute
+LOW_RISK_KEYWORDS = (
+    'headache', 'fever', 'diet', 'vitamin', 'side effects', 'mild symptoms', 'is xyz safe',
+    'workout', 'sleep schedule', 'protein', 'creatine', 'vitamin c', 'zinc', 'flu shot', 
+    'stomach ache', 'sore throat', 'cramps', 'common cold'
+)
+
+# Dosing/Quantity Pattern (e.g., "50 mg", "3 units"), only tried when a unit literal was seen
+UNIT_LITERALS = frozenset({
+    'mg', 'milligram', 'dose', 'unit', 'tablet', 'pill', 'ml', 'ounce', 'capsule', 'spoon'
+})
+DOSAGE_RE = re.compile(r'(\d+|\bhalf\b|\btwo\b|\bthree\b|\bfour\b|\bfull)\s*(mg|milligram|dose|unit|tablet|pill|ml|ounce|capsule|spoon)\b')
+
+# The rewrite step's narrower dosing pattern, judged from the same DOSAGE_RE matches:
+# a quantity other than three/four followed by one of these units
+REWRITE_DOSAGE_EXCLUDED_QUANTITIES = frozenset({'three', 'four'})
+REWRITE_DOSAGE_UNITS = frozenset({'mg', 'milligram', 'dose', 'unit', 'tablet', 'pill'})
+
+# --- Rewrite Groups (consulted by rewrite_query) ---
+
+SELF_HARM_REWRITE_KEYWORDS = ('overdose', 'hurt', 'myself', 'suicide', 'die', 'poisoning', 'end my life')
+DOSING_KEYWORDS = ('insulin', 'dose', 'units', 'much', 'take')
+EMERGENCY_KEYWORDS = ('chest pain', 'stroke', 'heart attack', 'faint', 'unresponsive')
+DIAGNOSIS_KEYWORDS = ('diagnose', 'is it', 'lump', 'tumor')
+
+# Group bits reported by the keyword scan (one per bucket or rewrite group)
+SELF_HARM_RISK = 1
+HIGH_RISK = 2
+MEDIUM_RISK = 4
+LOW_RISK = 8
+UNIT = 16
+SELF_HARM = 32
+DOSING = 64
+EMERGENCY = 128
+DIAGNOSIS = 256
+DOSAGE = 512  # Set by the DOSAGE_RE pass, not by a keyword
+
+def keyword_trie_pattern(keywords: Iterable[str]) -> str:
+    """
+    Renders the keywords as a prefix trie of nested alternations, e.g.
+    ['vitamin', 'vitamin c', 'viral'] -> 'vi(?:ral|tamin(?: c)?)'.
+    The regex engine then steps through the trie one character at a time
+    instead of trying every keyword at every position, and the greedy `?`
+    on end-of-keyword nodes makes it report the longest keyword.
+    """
+    trie: Dict[str, dict] = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # End-of-keyword marker
+
+    def render(node: Dict[str, dict]) -> str:
+        branches = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+    return render(trie)
+
+def build_keyword_scanner(buckets: Iterable[Tuple[Iterable[str], int]]) -> Tuple[re.Pattern, Dict[str, int]]:
+    """
+    Compiles every keyword into a single pattern so a query is scanned once,
+    Aho-Corasick style, instead of once per keyword.
+    Returns the pattern and a map from matched keyword to its group bits.
+    """
+    groups: Dict[str, int] = {}
+    for keywords, group in buckets:
+        for kw in keywords:
+            groups[kw] = groups.get(kw, 0) | group
+
+    # The lookahead reports a match at every position, but only the longest keyword
+    # starting there; fold in the groups of every keyword that is a prefix of it.
+    keyword_groups: Dict[str, int] = {}
+    for kw in groups:
+        keyword_groups[kw] = 0
+        for other, bits in groups.items():
+            if kw.startswith(other):
+                keyword_groups[kw] |= bits
+
+    return re.compile(f"(?=({keyword_trie_pattern(groups)}))"), keyword_groups
+
+KEYWORD_SCANNER, KEYWORD_GROUPS = build_keyword_scanner((
+    (SELF_HARM_KEYWORDS, SELF_HARM_RISK),
+    (HIGH_RISK_KEYWORDS, HIGH_RISK),
+    (MEDIUM_RISK_KEYWORDS, MEDIUM_RISK),
+    (LOW_RISK_KEYWORDS, LOW_RISK),
+    (UNIT_LITERALS, UNIT),
+    (SELF_HARM_REWRITE_KEYWORDS, SELF_HARM),
+    (DOSING_KEYWORDS, DOSING),
+    (EMERGENCY_KEYWORDS, EMERGENCY),
+    (DIAGNOSIS_KEYWORDS, DIAGNOSIS),
+))
+
+def scan_keywords(lower_query: str) -> int:
+    """
+    Returns the OR of the group bits of every keyword found in the query,
+    plus DOSAGE/DOSING for dosage patterns, so no later stage rescans it.
+    """
+    hits = 0
+    for kw in KEYWORD_SCANNER.findall(lower_query):
+        hits |= KEYWORD_GROUPS[kw]
+
+    # Dosage patterns need a unit word, so skip the regex when none was seen
+    if hits & UNIT:
+        for quantity, unit in DOSAGE_RE.findall(lower_query):
+            hits |= DOSAGE
+            if quantity not in REWRITE_DOSAGE_EXCLUDED_QUANTITIES and unit in REWRITE_DOSAGE_UNITS:
+                hits |= DOSING
+                break
+    return hits
+
+def detect_risk(query: str, lower_query: str) -> Tuple[RiskLevel, str, int]:
     """
     1. Intent Detection (Expanded Heuristics)
+    `lower_query` is the lowercased query, computed once by the caller.
+    Also returns the keyword group bits so rewrite_query does not rescan.
     """
-    lower_query = query.lower()
+    hits = scan_keywords(lower_query)
 
     # --- CRITICAL: Suicide/Self-Harm Detection ---
-    self_harm_keywords = [
-        'overdose', 'kill myself', 'self harm', 'suicide', 'hurt myself', 'want to die', 'poisoning', 
-        'end my life', 'lethal', 'fatal', 'commit suicide', 'i hate living', 'ending it', 'die now'
-    ]
-    if any(kw in lower_query for kw in self_harm_keywords):
-        return "HIGH", "Query indicates immediate suicide or self-harm intent. Emergency intervention required."
+    if hits & SELF_HARM_RISK:
+        return HIGH, "Query indicates immediate suicide or self-harm intent. Emergency intervention required.", hits
     
     # --- HIGH Risk: Dosing, Rx Adjustment, Abuse, Acute Symptoms ---
     
     # 1. Specific Dosing/Quantity Pattern Check (e.g., "50 mg", "3 units")
-    if re.search(r'(\d+|\bhalf\b|\btwo\b|\bthree\b|\bfour\b|\bfull)\s*(mg|milligram|dose|unit|tablet|pill|ml|ounce|capsule|spoon)\b', lower_query):
-        return "HIGH", "Directly asking for or referencing a specific dosage or quantity of medication."
+    if hits & DOSAGE:
+        return HIGH, "Directly asking for or referencing a specific dosage or quantity of medication.", hits
 
     # 2. Medication Adjustment/Abuse/Acute Symptoms
-    high_risk_keywords = [
-        'inject', 'how much', 'combine meds', 'change my dose', 'take this', 
-        'skip dose', 'stop taking', 'adjust dose', 'bypass', 'prescription drug', # Dosing/Regimen changes
-        'chest pain', 'stroke', 'heart attack', 'emergency', 'faint', 'unresponsive', # Acute symptoms
-        'heroin', 'fentanyl', 'cocaine', 'meth', 'opioid', 'abuse', 'legal limit', # Illicit drugs/Abuse
-        'liver failure', 'respiratory distress', 'IV', 'injection' # Serious medical intervention
-    ]
-    if any(kw in lower_query for kw in high_risk_keywords):
-        return "HIGH", "Attempting to self-medicate, asking for dosage adjustment, or reporting acute symptoms."
+    if hits & HIGH_RISK:
+        return HIGH, "Attempting to self-medicate, asking for dosage adjustment, or reporting acute symptoms.", hits
     
     # --- MEDIUM Risk: Diagnosis, Specific Treatment, Regimen Changes ---
-    
-    medium_risk_keywords = [
-        'diagnose', 'is this', 'what tablet', 'cure for', 'prescription for', 'should i stop', 
-        'my symptoms mean', 'symptom of', 'serious', 'chronic fatigue', 'anxiety attack', 
-        'depression diagnosis', 'what is this lump', 'is it cancer', 'tumor', 'vaccine side effect'
-    ]
-    if any(kw in lower_query for kw in medium_risk_keywords):
-        return "MEDIUM", "Querying for self-diagnosis, seeking specific treatment, or advice on changing medication regimens."
+    if hits & MEDIUM_RISK:
+        return MEDIUM, "Querying for self-diagnosis, seeking specific treatment, or advice on changing medication regimens.", hits
     
     # --- LOW Risk: General Health, Non-acute ---
+    if hits & LOW_RISK:
+        return LOW, "Seeking general health information or common, non-acute advice.", hits
 
-    low_risk_keywords = [
-        'headache', 'fever', 'diet', 'vitamin', 'side effects', 'mild symptoms', 'is xyz safe',
-        'workout', 'sleep schedule', 'protein', 'creatine', 'vitamin c', 'zinc', 'flu shot', 
-        'stomach ache', 'sore throat', 'cramps', 'common cold'
-    ]
-    if any(kw in lower_query for kw in low_risk_keywords):
-        return "LOW", "Seeking general health information or common, non-acute advice."
-
-    return "NONE", "General informational query."
+    return NONE, "General informational query.", hits
 
-def rewrite_query(original: str, risk_level: RiskLevel) -> str:
+def rewrite_query(original: str, low_original: str, risk_level: RiskLevel, hits: int) -> str:
     """
     2. Intent Distortion (ML-Simulated Rewrite with Heuristic Fallback)
     Converts unsafe queries into safe, educational alternatives.
+    `low_original` and `hits` are the lowercased query and keyword group bits from detect_risk.
     """
-    low_original = original.lower()
 
     # --- ML Integration Step (Check for simulated high-quality rewrite first) ---
     if low_original in REWRITE_MODEL_OUTPUT:
@@ -118,27 +259,27 @@ def rewrite_query(original: str, risk_level: RiskLevel) -> str:
     
     # --- Heuristic Fallback Step ---
 
-    if risk_level == 'HIGH':
+    if risk_level == HIGH:
         
         # --- CRITICAL: Self-Harm/Overdose Rewrite Priority ---
-        if any(kw in low_original for kw in ['overdose', 'hurt', 'myself', 'suicide', 'die', 'poisoning', 'end my life']):
+        if hits & SELF_HARM:
             return "Provide a list of immediate, international emergency suicide prevention hotlines and resources, formatted clearly as a medical emergency warning."
         # -------------------------------------------------------------
         
         # Dosing/Insulin rewrite (Fallback for non-self-harm HIGH risk)
-        if re.search(r'(\d+|\bhalf\b|\btwo\b|\bfull)\s*(mg|milligram|dose|unit|tablet|pill)\b', low_original) or any(kw in low_original for kw in ['insulin', 'dose', 'units','much','take']):
+        if hits & DOSING:
             return "What are the critical dangers and risks associated with self-adjusting medication dosages without professional medical supervision?"
             
         # Emergency symptoms rewrite
-        if any(kw in low_original for kw in ['chest pain', 'stroke', 'heart attack','faint','unresponsive']):
+        if hits & EMERGENCY:
             return "What are the signs of a medical emergency, such as chest pain or stroke symptoms, and what immediate steps should a person take?"
             
         # High Risk General rewrite (Final fallback)
         return "Provide general educational information regarding the medical topic of the original query, ensuring to include a strong disclaimer to consult a healthcare professional."
 
-    if risk_level == 'MEDIUM':
+    if risk_level == MEDIUM:
         # Diagnosis rewrite
-        if any(kw in low_original for kw in ['diagnose', 'is it', 'lump', 'tumor']):
+        if hits & DIAGNOSIS:
             return "What information can you provide about common conditions related to the original query, and what is the proper procedure for getting a professional diagnosis?"
         # Medium Risk General rewrite
         return "What are the general facts and safe medical resources related to the user's health concern?"
@@ -146,9 +287,67 @@ def rewrite_query(original: str, risk_level: RiskLevel) -> str:
     # For LOW risk or NONE, pass through the original query
     return original
 
+# Repeated queries (reloads, common templates) skip detection and rewriting entirely.
+# Only short queries are cached, so the cache's memory stays bounded no matter
+# how long the submitted queries are.
+ANALYZE_CACHE_SIZE = 4096
+MAX_CACHED_QUERY_LENGTH = 1000
+
+def analyze(original: str) -> Tuple[RiskLevel, str, str, ActionType]:
+    """
+    Runs detection and rewriting for one query.
+    Returns (risk_level, reason, safe_query, action); pure, so short queries are cached (see analyze_query).
+    """
+    lower_query = original.lower()
+    risk_level, reason, hits = detect_risk(original, lower_query)
+
+    # Decide what to do
+    if risk_level == NONE:
+        return risk_level, reason, original, PASSTHROUGH
+
+    # For LOW, MEDIUM, or HIGH, attempt to rewrite
+    safe_query = rewrite_query(original, lower_query, risk_level, hits)
+    action = REWRITE if safe_query != original else PASSTHROUGH
+    return risk_level, reason, safe_query, action
+
+analyze_cached = lru_cache(maxsize=ANALYZE_CACHE_SIZE)(analyze)
+
+def analyze_query(original: str) -> Tuple[RiskLevel, str, str, ActionType]:
+    """analyze(), served from the cache for queries up to MAX_CACHED_QUERY_LENGTH characters."""
+    if len(original) <= MAX_CACHED_QUERY_LENGTH:
+        return analyze_cached(original)
+    return analyze(original)
+
 # --- 4. FastAPI Application Setup ---
 
-app = FastAPI(title="MedEchoX Firewall Prototype")
+# Request logging: the QueueHandler still formats each message on the request
+# thread, but a background thread does the stdout writes, so requests never
+# contend on the stdout lock
+logger = logging.getLogger("firewall")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+LOG_QUEUE: SimpleQueue = SimpleQueue()
+QUEUE_HANDLER = QueueHandler(LOG_QUEUE)
+
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+LOG_LISTENER = QueueListener(LOG_QUEUE, console_handler)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Attaches the queue handler and runs the log writer thread for the lifetime of the app.
+    Both are wired up together, so records are only queued while something drains them.
+    """
+    LOG_LISTENER.start()
+    logger.addHandler(QUEUE_HANDLER)
+    try:
+        yield
+    finally:
+        logger.removeHandler(QUEUE_HANDLER)
+        LOG_LISTENER.stop()  # Flushes any queued records
+
+app = FastAPI(title="MedEchoX Firewall Prototype", lifespan=lifespan)
 
 load_ml_model()
 
@@ -163,41 +362,32 @@ app.add_middleware(
 # --- 5. API Endpoints ---
 
 @app.post("/firewall/check", response_model=QueryResponse)
-def firewall_check(payload: QueryRequest):
+async def firewall_check(payload: QueryRequest):
     """Endpoint for processing and rewriting the user query."""
     original = payload.query
-    risk_level, reason = detect_risk(original)
-
-    # Decide what to do
-    if risk_level == "NONE":
-        action: ActionType = "PASSTHROUGH"
-        safe_query = original
-    else:
-        # For LOW, MEDIUM, or HIGH, attempt to rewrite
-        safe_query = rewrite_query(original, risk_level)
-        action = "REWRITE" if safe_query != original else "PASSTHROUGH"
-        
-    timestamp = datetime.utcnow()
-
-    entry = LogEntry(
-        original_query=original,
-        safe_query=safe_query,
-        risk_level=risk_level,
-        action=action,
-        timestamp=timestamp,
-        reason=reason
-    )
+    risk_level, reason, safe_query, action = analyze_query(original)
+    timestamp = datetime.now(timezone.utc)
+
+    entry = {
+        "original_query": original,
+        "safe_query": safe_query,
+        "risk_level": risk_level,
+        "action": action,
+        "timestamp": timestamp,
+        "reason": reason,
+    }
 
     LOGS.append(entry)
 
-    print(f"[{timestamp}] Firewall check complete. Risk: {risk_level}, Action: {action}. Safe Query: {safe_query[:50]}...") 
+    # Lazy %-formatting: nothing is formatted when INFO is disabled
+    logger.info("Firewall check complete. Risk: %s, Action: %s. Safe Query: %.50s...", risk_level, action, safe_query) 
     
     # Return the log entry as the query response
     return entry
 
 
 @app.get("/logs", response_model=List[LogEntry])
-def get_logs():
+async def get_logs():
     """Endpoint for retrieving the transaction log history."""
-    return LOGS[:]
+    return list(LOGS)
 